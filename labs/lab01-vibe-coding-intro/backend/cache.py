@@ -1,17 +1,28 @@
 """LRU Cache for URL lookups - Module for caching URL mappings in memory"""
 
 from datetime import datetime
+from itertools import count
 from threading import Lock
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
 
 from cachetools import LRUCache
 
+# Maximum number of independent shards (a power of two so a bit mask selects the shard)
+NUM_SHARDS = 16
+
+
+def _counter_value(counter: count) -> int:
+    """Read the next value of an ``itertools.count`` without advancing it."""
+    return int(repr(counter)[len("count(") : -1])
+
 
 class URLCache:
     """Thread-safe LRU cache for URL lookups.
 
     This cache reduces database queries for frequently accessed codes by maintaining
-    an in-memory cache of URL mappings with LRU eviction policy.
+    an in-memory cache of URL mappings with LRU eviction policy. Entries are spread
+    across up to ``NUM_SHARDS`` independent LRU buckets, each guarded by its own lock, so
+    lookups for different codes do not contend on a single mutex.
     """
 
     def __init__(self, max_size: int = 1000):
@@ -20,38 +31,76 @@ class URLCache:
         Args:
             max_size: Maximum number of entries in the cache.
         """
-        self.cache: LRUCache = LRUCache(maxsize=max_size)
-        self.lock = Lock()
-        self.hits = 0
-        self.misses = 0
-
-    def get(self, key: str) -> Optional[str]:
+        # Fewer shards for tiny caches, so every shard holds at least one entry
+        num_shards = NUM_SHARDS
+        while num_shards > 1 and num_shards > max_size:
+            num_shards //= 2
+        self._mask = num_shards - 1
+        # Spread the remainder so the shard sizes add up to exactly max_size
+        base, extra = divmod(max_size, num_shards)
+        self.shards: list[LRUCache] = [LRUCache(maxsize=base + (i < extra)) for i in range(num_shards)]
+        self.locks: list[Lock] = [Lock() for _ in range(num_shards)]
+        self.max_size = max_size
+        # Bumped by invalidate()/clear(), so a lookup that started before an invalidation
+        # can tell its result is stale and skip caching it
+        self.generations: list[int] = [0] * num_shards
+        # itertools.count increments atomically under the GIL, so hits/misses are
+        # recorded without taking a lock on the read path
+        self._hits = count()
+        self._misses = count()
+
+    def _shard(self, key: str) -> int:
+        """Return the shard index for a key."""
+        return hash(key) & self._mask
+
+    def get(self, key: str) -> Optional[Any]:
         """Get value from cache, recording hit/miss.
 
         Args:
             key: The short code.
 
         Returns:
-            The original URL if found, None otherwise.
+            The cached URL record if found, None otherwise.
         """
-        with self.lock:
-            if key in self.cache:
-                self.hits += 1
-                return self.cache[key]
-            else:
-                self.misses += 1
-                return None
-
-    def set(self, key: str, value: Optional[str]) -> None:
-        """Set value in cache, evicting LRU entry if necessary.
+        i = self._shard(key)
+        shard = self.shards[i]
+        with self.locks[i]:
+            found = key in shard
+            value = shard[key] if found else None
+        next(self._hits if found else self._misses)
+        return value
+
+    def generation(self, key: str) -> int:
+        """Get the invalidation generation of the shard holding a key.
 
         Args:
             key: The short code.
-            value: The original URL (or None if not found).
+
+        Returns:
+            A value to pass to ``set`` once the lookup for ``key`` completes.
         """
-        with self.lock:
-            self.cache[key] = value
+        i = self._shard(key)
+        with self.locks[i]:
+            return self.generations[i]
 
+    def set(self, key: str, value: Any, generation: Optional[int] = None) -> bool:
+        """Set value in cache, evicting LRU entry if necessary.
+
+        Args:
+            key: The short code.
+            value: The URL record, e.g. (original_url, expires_at), or a not-found sentinel.
+            generation: Result of ``generation(key)`` taken before the value was loaded. If the
+                shard was invalidated since then, the value may be stale and is not stored.
+
+        Returns:
+            True if the value was stored.
+        """
+        i = self._shard(key)
+        with self.locks[i]:
+            if generation is not None and generation != self.generations[i]:
+                return False
+            self.shards[i][key] = value
+            return True
 
     def invalidate(self, key: str) -> None:
         """Remove specific key from cache.
@@ -59,15 +108,19 @@ class URLCache:
         Args:
             key: The short code to invalidate.
         """
-        with self.lock:
-            self.cache.pop(key, None)
+        i = self._shard(key)
+        with self.locks[i]:
+            self.shards[i].pop(key, None)
+            self.generations[i] += 1
 
     def clear(self) -> None:
         """Clear all cache entries and reset statistics."""
-        with self.lock:
-            self.cache.clear()
-            self.hits = 0
-            self.misses = 0
+        for i, shard in enumerate(self.shards):
+            with self.locks[i]:
+                shard.clear()
+                self.generations[i] += 1
+        self._hits = count()
+        self._misses = count()
 
     def stats(self) -> Dict:
         """Get cache statistics.
@@ -75,17 +128,18 @@ class URLCache:
         Returns:
             Dictionary containing cache stats including size, hit rate, etc.
         """
-        with self.lock:
-            total = self.hits + self.misses
-            hit_rate = self.hits / total if total > 0 else 0
-            return {
-                "size": len(self.cache),
-                "max_size": self.cache.maxsize,
-                "hits": self.hits,
-                "misses": self.misses,
-                "hit_rate": hit_rate,
-                "timestamp": datetime.now().isoformat(),
-            }
+        hits = _counter_value(self._hits)
+        misses = _counter_value(self._misses)
+        total = hits + misses
+        hit_rate = hits / total if total > 0 else 0
+        return {
+            "size": self.size(),
+            "max_size": self.max_size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hit_rate,
+            "timestamp": datetime.now().isoformat(),
+        }
 
     def size(self) -> int:
         """Get current cache size.
@@ -93,5 +147,4 @@ class URLCache:
         Returns:
             Number of entries currently in the cache.
         """
-        with self.lock:
-            return len(self.cache)
+        return sum(len(shard) for shard in self.shards)
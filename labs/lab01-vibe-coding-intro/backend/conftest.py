@@ -0,0 +1,98 @@
+"""Shared fixtures for the URL Shortener API tests."""
+
+import itertools
+import os
+import sys
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+
+# Add backend to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Use an in-memory test database (no disk I/O)
+os.environ["DATABASE_PATH"] = ":memory:"
+# Every request comes from the same client IP, and nothing resets its window between tests
+os.environ["RATE_LIMIT_REQUESTS"] = "100000"
+
+URL_SEQ = itertools.count()
+
+
+def make_url(tag: str) -> str:
+    """Return a URL no other test (or xdist worker) shortens, so tests never share rows or cache entries."""
+    return f"https://example.com/{tag}-{os.getpid()}-{next(URL_SEQ)}"
+
+
+# FastAPI, Starlette, httpx and the app itself are imported inside the fixtures that need them,
+# so collection (e.g. pytest --collect-only) doesn't pay for them
+
+
+@pytest.fixture(scope="session")
+def main_module():
+    """The backend's main module, imported on first use with its database initialized."""
+    import main
+
+    main.init_db()
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(main_module):
+    """Test client shared by the whole session.
+
+    Entered once, so the app's lifespan (startup, background click flusher, shutdown)
+    runs a single time around the whole session.
+    """
+    from fastapi.testclient import TestClient
+
+    with TestClient(main_module.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def file_db(main_module, tmp_path, monkeypatch):
+    """Point the app at an empty database file for one test; returns the file's path."""
+    import threading
+
+    db_file = tmp_path / "urls.db"
+    monkeypatch.setattr(main_module, "DATABASE_FILE", db_file)
+    monkeypatch.setattr(main_module, "DATABASE_IN_MEMORY", False)
+    monkeypatch.setattr(main_module, "_db_local", threading.local())
+    yield db_file
+    conn = getattr(main_module._db_local, "conn", None)
+    if conn is not None:
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def db_conn(main_module):
+    """The app's SQLite connection, for asserting on stored rows directly."""
+    return main_module.get_conn()
+
+
+# URLs shared by read-only tests, created once per session with a single POST /shorten/batch
+FIXTURE_URLS = {
+    "redirect": make_url("redirect-test"),
+    "info": make_url("info-test"),
+    "delete": make_url("delete-test"),
+    "qrcode": make_url("qr-test"),
+}
+
+
+@pytest.fixture(scope="session")
+def created_codes(client):
+    """Map each FIXTURE_URLS tag to its short code."""
+    response = client.post("/shorten/batch", json={"urls": list(FIXTURE_URLS.values())})
+    assert response.status_code == 201
+    return {tag: item["short_code"] for tag, item in zip(FIXTURE_URLS, response.json())}
+
+
+@pytest_asyncio.fixture
+async def async_client(main_module):
+    """Async client calling the app in-process, for firing concurrent requests."""
+    import httpx
+
+    transport = httpx.ASGITransport(app=main_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
@@ -1,20 +1,29 @@
 """URL Shortener Backend - FastAPI Implementation"""
 
+import asyncio
 import logging
+import math
 import os
-import random
+import queue
+import re
 import sqlite3
 import string
-from collections import defaultdict
-from contextlib import asynccontextmanager
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+from time import gmtime, strftime
 from time import time as current_time
-from typing import Optional
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
 
-from fastapi import FastAPI, HTTPException, Request, status
+from cachetools import TTLCache
+from fastapi import APIRouter, FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
-from pydantic import BaseModel, HttpUrl, field_validator
+from fastapi.responses import JSONResponse, ORJSONResponse, RedirectResponse, Response
+from pydantic import BaseModel, Field, field_validator
 
 try:
     from cache import URLCache
@@ -26,59 +35,161 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 # Configuration from environment variables
-DATABASE_PATH = os.getenv("DATABASE_PATH", "/data")
-DATABASE_FILE = Path(DATABASE_PATH) / "urls.db"
+DATABASE_PATH = os.getenv("DATABASE_PATH", "/data")  # directory for urls.db, or ":memory:" (e.g. for tests)
+DATABASE_IN_MEMORY = DATABASE_PATH == ":memory:"
+DATABASE_FILE = ":memory:" if DATABASE_IN_MEMORY else Path(DATABASE_PATH) / "urls.db"
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
+SHORT_URL_PREFIX = BASE_URL + "/"
 SHORT_CODE_LENGTH = 6
+SHORT_CODE_ATTEMPTS = 5  # retries when a generated code collides with an existing one
+# Maps every byte value onto the 62 alphanumeric characters, so a random code is one urandom() + translate()
+SHORT_CODE_TABLE = bytes((string.ascii_letters + string.digits).encode()[i % 62] for i in range(256))
 CACHE_SIZE = int(os.getenv("CACHE_SIZE", "1000"))
 
+# Fast prefilter for accepted URLs: http(s) scheme, a netloc, no whitespace or control characters.
+# check_url() then confirms the netloc holds a real host and a valid port.
+URL_PATTERN = re.compile(r"https?://[^\s\x00-\x1f\x7f/?#]+[^\s\x00-\x1f\x7f]*", re.IGNORECASE)
+MAX_URL_LENGTH = 2083
+MAX_BATCH_SIZE = 100  # URLs per POST /shorten/batch request
+
 # Initialize cache
 cache = URLCache(max_size=CACHE_SIZE)
 
+# Rendered QR code PNGs kept by render_qrcode (QR output is deterministic per short URL)
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "512"))
+
 # Ensure database directory exists
-DATABASE_FILE.parent.mkdir(parents=True, exist_ok=True)
+if not DATABASE_IN_MEMORY:
+    DATABASE_FILE.parent.mkdir(parents=True, exist_ok=True)
+
+# Clicks are queued by redirects and written in batches off the request path
+CLICK_BATCH_SIZE = int(os.getenv("CLICK_BATCH_SIZE", "500"))
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "0.2"))  # seconds
+# Pending clicks: (short_code, user_agent, ip_address, referrer, clicked_at)
+click_queue: queue.SimpleQueue = queue.SimpleQueue()
+click_flush_lock = threading.Lock()
+# Clicks from batches whose write failed, retried first on the next flush (guarded by click_flush_lock)
+unwritten_clicks: list[tuple] = []
+
+# Per-thread SQLite connections (reused across requests to keep the page cache warm).
+# An in-memory database only exists inside one connection, so all threads share a single one.
+_db_local = threading.local()
+_shared_conn: Optional[sqlite3.Connection] = None
+_shared_conn_lock = threading.Lock()
+# Total SQLite page cache budget, split across the connections that can be open at once:
+# one per default executor thread (used by asyncio.to_thread) plus the event loop thread
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "32"))
+_max_connections = 1 if DATABASE_IN_MEMORY else min(32, (os.cpu_count() or 1) + 4) + 1
+SQLITE_CACHE_KB_PER_CONN = max(1024, SQLITE_CACHE_MB * 1024 // _max_connections)
+# Serialises write transactions on the shared connection (see transaction())
+_write_lock = threading.RLock()
 
-# Rate limiting tracker (IP -> list of request timestamps)
-rate_limit_tracker: dict = defaultdict(list)
 RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "60"))
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # seconds
+RATE_LIMIT_MAX_IPS = int(os.getenv("RATE_LIMIT_MAX_IPS", "100000"))
+RATE_LIMIT_SHARDS = 16  # power of two so a bit mask selects the shard
+# Each URL in a batch is charged as one request, so a batch can't exceed one window's allowance
+BATCH_LIMIT = min(MAX_BATCH_SIZE, RATE_LIMIT_REQUESTS)
+
+# Rate limiting tracker (IP -> ring buffer of the most recent request timestamps).
+# Split into shards with one lock each; IPs idle for two windows expire automatically.
+rate_limit_tracker: list[TTLCache] = [
+    TTLCache(maxsize=RATE_LIMIT_MAX_IPS // RATE_LIMIT_SHARDS, ttl=RATE_LIMIT_WINDOW * 2) for _ in range(RATE_LIMIT_SHARDS)
+]
+rate_limit_locks = [threading.Lock() for _ in range(RATE_LIMIT_SHARDS)]
 
 
-def check_rate_limit(ip: str) -> tuple[bool, Optional[dict]]:
-    """Check if client has exceeded rate limit.
+def check_rate_limit(ip: str, cost: int = 1) -> tuple[bool, Optional[dict]]:
+    """Check if client has exceeded rate limit, charging ``cost`` requests if not.
 
     Returns:
         (is_allowed, retry_after_info_dict_or_none)
     """
     now = current_time()
-    # Remove old requests outside the window
-    rate_limit_tracker[ip] = [req_time for req_time in rate_limit_tracker[ip] if now - req_time < RATE_LIMIT_WINDOW]
+    i = hash(ip) & (RATE_LIMIT_SHARDS - 1)
+    shard = rate_limit_tracker[i]
+    with rate_limit_locks[i]:
+        requests = shard.get(ip)
+        if requests is None:
+            requests = deque(maxlen=RATE_LIMIT_REQUESTS)
+        # Re-insert on every request so active IPs don't expire
+        shard[ip] = requests
+
+        # Drop old requests outside the window (timestamps are in arrival order)
+        while requests and now - requests[0] >= RATE_LIMIT_WINDOW:
+            requests.popleft()
+
+        excess = len(requests) + cost - RATE_LIMIT_REQUESTS
+        if excess > 0:
+            # Rate limit exceeded; wait until enough of the oldest requests leave the window
+            freeing_request = requests[min(excess, len(requests)) - 1]
+            retry_after = int(RATE_LIMIT_WINDOW - (now - freeing_request)) + 1
+            return False, {"retry_after": retry_after, "limit": RATE_LIMIT_REQUESTS, "window": RATE_LIMIT_WINDOW}
+
+        # Record this request
+        requests.extend([now] * cost)
+    return True, None
 
-    if len(rate_limit_tracker[ip]) >= RATE_LIMIT_REQUESTS:
-        # Rate limit exceeded
-        oldest_request = rate_limit_tracker[ip][0]
-        retry_after = int(RATE_LIMIT_WINDOW - (now - oldest_request)) + 1
-        return False, {"retry_after": retry_after, "limit": RATE_LIMIT_REQUESTS, "window": RATE_LIMIT_WINDOW}
 
-    # Record this request
-    rate_limit_tracker[ip].append(now)
-    return True, None
+def rate_limited_response(client_ip: str, limit_info: dict) -> JSONResponse:
+    """Build the 429 response for a client over its rate limit"""
+    logger.warning(f"Rate limit exceeded for IP {client_ip}")
+    return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded", "retry_after": limit_info["retry_after"]})
+
+
+def expire_rate_limits() -> None:
+    """Evict IPs whose rate limit entries have expired."""
+    for shard, lock in zip(rate_limit_tracker, rate_limit_locks):
+        with lock:
+            shard.expire()
+
+
+async def rate_limit_cleanup() -> None:
+    """Background task that periodically evicts idle IPs from the rate limit tracker."""
+    while True:
+        await asyncio.sleep(RATE_LIMIT_WINDOW)
+        expire_rate_limits()
 
 
 # Pydantic Models
+def check_url(v: str) -> str:
+    """Validate URL is a non-empty HTTP/HTTPS URL"""
+    if not v:
+        raise ValueError("URL cannot be empty")
+    if len(v) > MAX_URL_LENGTH or not URL_PATTERN.fullmatch(v):
+        raise ValueError("URL must be a valid HTTP or HTTPS URL")
+    try:
+        parts = urlsplit(v)
+        parts.port  # raises ValueError for a non-numeric or out-of-range port
+    except ValueError:
+        raise ValueError("URL must be a valid HTTP or HTTPS URL")
+    if not parts.hostname:
+        raise ValueError("URL must be a valid HTTP or HTTPS URL")
+    return v
+
+
 class URLRequest(BaseModel):
     """Request model for URL shortening"""
 
-    url: HttpUrl
+    url: str
     custom_code: Optional[str] = None
     expires_at: Optional[str] = None
 
     @field_validator("url")
     @classmethod
-    def validate_url(cls, v: HttpUrl) -> HttpUrl:
-        """Validate URL is not empty"""
-        if not str(v):
-            raise ValueError("URL cannot be empty")
+    def validate_url(cls, v: str) -> str:
+        """Validate URL is a non-empty HTTP/HTTPS URL"""
+        return check_url(v)
+
+    @field_validator("expires_at")
+    @classmethod
+    def validate_expires_at(cls, v: Optional[str]) -> Optional[str]:
+        """Validate expiration is an ISO format datetime if provided"""
+        if v:
+            try:
+                datetime.fromisoformat(v)
+            except ValueError:
+                raise ValueError("expires_at must be an ISO format datetime")
         return v
 
     @field_validator("custom_code")
@@ -97,6 +208,18 @@ class URLRequest(BaseModel):
         return v
 
 
+class BatchURLRequest(BaseModel):
+    """Request model for shortening several URLs at once"""
+
+    urls: list[str] = Field(min_length=1, max_length=BATCH_LIMIT)
+
+    @field_validator("urls")
+    @classmethod
+    def validate_urls(cls, v: list[str]) -> list[str]:
+        """Validate every URL is a non-empty HTTP/HTTPS URL"""
+        return [check_url(url) for url in v]
+
+
 class URLResponse(BaseModel):
     """Response model for shortened URL"""
 
@@ -145,11 +268,67 @@ class AnalyticsListResponse(BaseModel):
 
 
 # Database Functions
+def _open_conn() -> sqlite3.Connection:
+    """Open and tune a new SQLite connection."""
+    # Queries use fixed SQL with ? placeholders, so each one is parsed once per connection and then
+    # served from the prepared-statement cache
+    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA busy_timeout=5000")  # wait for a competing writer instead of failing
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA wal_autocheckpoint=1000")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB_PER_CONN}")  # negative means KiB, not pages
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_conn() -> sqlite3.Connection:
+    """Return the calling thread's persistent SQLite connection.
+
+    The connection is opened (and tuned) on first use and then reused for every
+    subsequent request handled by the same thread. Wrap writes in ``with transaction() as conn:``
+    rather than using the connection as a context manager directly. With
+    ``DATABASE_PATH=":memory:"`` every thread gets the same process-wide connection.
+    """
+    global _shared_conn
+    if DATABASE_IN_MEMORY:
+        if _shared_conn is None:
+            with _shared_conn_lock:
+                if _shared_conn is None:
+                    _shared_conn = _open_conn()
+        return _shared_conn
+
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = _open_conn()
+        _db_local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Run a write transaction on the calling thread's connection.
+
+    Commits on success and rolls back on error. Threads sharing the in-memory
+    connection take turns, so one thread's commit or rollback never ends a
+    transaction another thread still has open.
+    """
+    conn = get_conn()
+    if not DATABASE_IN_MEMORY:
+        with conn:
+            yield conn
+        return
+    with _write_lock, conn:
+        yield conn
+
+
 def init_db() -> None:
     """Initialize SQLite database"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = get_conn()
     cursor = conn.cursor()
 
+    # WAL lets readers proceed while a click is being committed (persisted in the db file)
+    cursor.execute("PRAGMA journal_mode=WAL")
+
     # Create urls table with click tracking
     cursor.execute(
         """
@@ -157,15 +336,28 @@ def init_db() -> None:
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             short_code TEXT UNIQUE NOT NULL,
             original_url TEXT NOT NULL,
-            click_count INTEGER DEFAULT 0,
+            click_count INTEGER DEFAULT 0,  -- unused: counts are derived from the clicks table
             is_custom BOOLEAN DEFAULT 0,
             expires_at TIMESTAMP,
+            expires_at_ts INTEGER,  -- expires_at as unix epoch seconds, checked on every redirect
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_accessed_at TIMESTAMP
+            last_accessed_at TIMESTAMP  -- unused: derived from MAX(clicks.clicked_at)
         )
         """
     )
 
+    # Add expires_at_ts to databases created before it existed, backfilled from expires_at.
+    # Column and backfill commit together, so a failed start can't leave the column half filled.
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(urls)")}
+    if "expires_at_ts" not in columns:
+        cursor.execute("BEGIN")
+        with conn:
+            cursor.execute("ALTER TABLE urls ADD COLUMN expires_at_ts INTEGER")
+            rows = cursor.execute("SELECT id, expires_at FROM urls WHERE expires_at IS NOT NULL").fetchall()
+            cursor.executemany(
+                "UPDATE urls SET expires_at_ts = ? WHERE id = ?", [(legacy_expiry_timestamp(row_id, exp), row_id) for row_id, exp in rows]
+            )
+
     # Create clicks table for tracking individual clicks
     cursor.execute(
         """
@@ -182,11 +374,15 @@ def init_db() -> None:
     )
 
     # Create indices for performance
+    # Covering index for the redirect lookup: short_code -> (original_url, expires_at_ts) is answered
+    # from the index alone, without a second lookup into the table
     cursor.execute(
         """
-        CREATE INDEX IF NOT EXISTS idx_urls_short_code ON urls(short_code)
+        CREATE INDEX IF NOT EXISTS idx_urls_redirect_cover ON urls(short_code, original_url, expires_at_ts)
         """
     )
+    # Superseded by the covering index above (and by the UNIQUE constraint's own index)
+    cursor.execute("DROP INDEX IF EXISTS idx_urls_short_code")
     cursor.execute(
         """
         CREATE INDEX IF NOT EXISTS idx_urls_created_at ON urls(created_at)
@@ -199,171 +395,305 @@ def init_db() -> None:
     )
 
     conn.commit()
-    conn.close()
 
 
 def generate_short_code() -> str:
-    """Generate a unique 6-character alphanumeric short code"""
-    characters = string.ascii_letters + string.digits
-    while True:
-        code = "".join(random.choices(characters, k=SHORT_CODE_LENGTH))
-        # Check if code already exists
-        if not code_exists(code):
-            return code
+    """Generate a random 6-character alphanumeric short code (uniqueness is enforced on insert)"""
+    return os.urandom(SHORT_CODE_LENGTH).translate(SHORT_CODE_TABLE).decode()
 
 
-def code_exists(code: str) -> bool:
-    """Check if a short code already exists in database"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM urls WHERE short_code = ?", (code,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+def expiry_timestamp(expires_at: Optional[str]) -> Optional[int]:
+    """Convert an ISO format expiration datetime to unix epoch seconds"""
+    if not expires_at:
+        return None
+    # Round up so a fractional expiration never takes effect early
+    return math.ceil(datetime.fromisoformat(expires_at).timestamp())
 
 
-def get_original_url(code: str) -> Optional[str]:
-    """Retrieve original URL for a given short code"""
-    # Check cache first
-    cached_url = cache.get(code)
-    if cached_url is not None:
-        # Return None if explicitly cached as not found
-        return cached_url if cached_url != "__NOT_FOUND__" else None
+def legacy_expiry_timestamp(row_id: int, expires_at) -> Optional[int]:
+    """Convert a stored expires_at that predates validation, treating unparseable values as already expired"""
+    try:
+        return expiry_timestamp(expires_at)
+    except (TypeError, ValueError):
+        logger.warning(f"URL {row_id} has unparseable expires_at {expires_at!r}; treating it as expired")
+        return 0
 
-    # Fall back to database
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT original_url FROM urls WHERE short_code = ?", (code,))
-    result = cursor.fetchone()
-    conn.close()
+
+def insert_url(short_code: str, original_url: str, is_custom: bool = False, expires_at: Optional[str] = None) -> bool:
+    """Insert a URL mapping unless the short code is already taken.
+
+    Returns:
+        True if the row was inserted, False if the short code already exists.
+    """
+    with transaction() as conn:
+        cursor = conn.execute(
+            """
+            INSERT OR IGNORE INTO urls (short_code, original_url, is_custom, expires_at, expires_at_ts)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (short_code, original_url, is_custom, expires_at, expiry_timestamp(expires_at)),
+        )
+    return cursor.rowcount == 1
+
+
+def create_short_code(original_url: str, custom_code: Optional[str] = None, expires_at: Optional[str] = None) -> str:
+    """Store a URL and return its short code, reusing the existing code if the URL is already shortened"""
+    # Check if URL already exists (with same custom/expiration settings)
+    existing_code = get_existing_code(original_url)
+    if existing_code:
+        return existing_code
+
+    # Save URL with custom flag and expiration; the UNIQUE index on short_code detects collisions
+    if custom_code:
+        if not insert_url(custom_code, original_url, is_custom=True, expires_at=expires_at):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Custom code '{custom_code}' is already taken")
+        return custom_code
+
+    for _ in range(SHORT_CODE_ATTEMPTS):
+        short_code = generate_short_code()
+        if insert_url(short_code, original_url, expires_at=expires_at):
+            return short_code
+    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save URL mapping")
+
+
+def create_short_codes(original_urls: list[str]) -> list[str]:
+    """Store a batch of URLs in one transaction and return their short codes in input order"""
+    unique_urls = list(dict.fromkeys(original_urls))
+
+    with transaction() as conn:
+        # Reuse codes of URLs that are already shortened (and of duplicates within the batch)
+        codes: dict[str, Optional[str]] = dict.fromkeys(unique_urls)
+        placeholders = ", ".join("?" * len(unique_urls))
+        for url, code in conn.execute(f"SELECT original_url, short_code FROM urls WHERE original_url IN ({placeholders})", unique_urls):
+            if codes[url] is None:
+                codes[url] = code
+        pending = [url for url, code in codes.items() if code is None]
+
+        for _ in range(SHORT_CODE_ATTEMPTS):
+            if not pending:
+                break
+            rows = [(generate_short_code(), url) for url in pending]
+            cursor = conn.executemany("INSERT OR IGNORE INTO urls (short_code, original_url) VALUES (?, ?)", rows)
+            if cursor.rowcount == len(rows):
+                codes.update((url, code) for code, url in rows)
+                pending = []
+                break
+
+            # Some generated codes collided; keep the rows that made it in and retry the rest
+            pending = []
+            for code, url in rows:
+                owner = conn.execute("SELECT original_url FROM urls WHERE short_code = ?", (code,)).fetchone()
+                if owner[0] == url:
+                    codes[url] = code
+                else:
+                    pending.append(url)
+
+        if pending:
+            # Raised inside the transaction so the rows inserted so far are rolled back
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save URL mapping")
+    return [codes[url] for url in original_urls]
+
+
+def delete_url_record(short_code: str) -> bool:
+    """Delete a URL and its clicks.
+
+    Returns:
+        True if the URL was deleted, False if the short code does not exist.
+    """
+    # Write pending clicks first so none are left behind for the deleted code
+    flush_clicks()
+    conn = get_conn()
+
+    # Check if URL exists
+    if not conn.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,)).fetchone():
+        return False
+
+    with transaction():
+        # Delete clicks
+        conn.execute("DELETE FROM clicks WHERE short_code = ?", (short_code,))
+        # Delete URL
+        conn.execute("DELETE FROM urls WHERE short_code = ?", (short_code,))
+    return True
+
+
+def fetch_url_record(code: str) -> Optional[tuple[str, Optional[int]]]:
+    """Load (original_url, expires_at_ts) for a short code from the database and cache the result"""
+    # A write that invalidates the code while this runs bumps the generation, and the result isn't cached
+    generation = cache.generation(code)
+    # The planner would otherwise pick the UNIQUE autoindex and then read the table row
+    result = get_conn().execute(
+        "SELECT original_url, expires_at_ts FROM urls INDEXED BY idx_urls_redirect_cover WHERE short_code = ?", (code,)
+    ).fetchone()
 
     if result:
-        url = result[0]
-        cache.set(code, url)  # Cache the result
-        return url
+        record = (result[0], result[1])
+        cache.set(code, record, generation)  # Cache the result
+        return record
 
     # Cache negative result to avoid repeated DB lookups
-    cache.set(code, "__NOT_FOUND__")
+    cache.set(code, "__NOT_FOUND__", generation)
     return None
 
 
+async def get_url_record(code: str) -> Optional[tuple[str, Optional[int]]]:
+    """Retrieve (original_url, expires_at_ts) for a given short code"""
+    # Check cache first
+    cached = cache.get(code)
+    if cached is not None:
+        # Return None if explicitly cached as not found
+        return cached if cached != "__NOT_FOUND__" else None
+
+    # Fall back to database (in a worker thread so the event loop isn't blocked)
+    return await asyncio.to_thread(fetch_url_record, code)
+
+
+async def get_original_url(code: str) -> Optional[str]:
+    """Retrieve original URL for a given short code"""
+    record = await get_url_record(code)
+    return record[0] if record else None
+
+
 def get_existing_code(url: str) -> Optional[str]:
     """Check if URL already exists and return its short code"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT short_code FROM urls WHERE original_url = ?", (url,))
-    result = cursor.fetchone()
-    conn.close()
+    result = get_conn().execute("SELECT short_code FROM urls WHERE original_url = ?", (url,)).fetchone()
     return result[0] if result else None
 
 
 def record_click(short_code: str, user_agent: Optional[str] = None, ip_address: Optional[str] = None, referrer: Optional[str] = None) -> None:
-    """Record a click for a shortened URL."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    try:
-        # Insert click record
-        cursor.execute(
-            """
-            INSERT INTO clicks (short_code, user_agent, ip_address, referrer)
-            VALUES (?, ?, ?, ?)
-            """,
-            (short_code, user_agent, ip_address, referrer),
-        )
+    """Queue a click for a shortened URL; it is written to the database by flush_clicks()."""
+    click_queue.put((short_code, user_agent, ip_address, referrer, strftime("%Y-%m-%d %H:%M:%S", gmtime())))
+
 
-        # Update click count and last accessed time
-        cursor.execute(
+def record_clicks(clicks: list[tuple]) -> None:
+    """Write a batch of queued clicks in a single transaction."""
+    # Click counts and last access times are derived from the clicks table, so this is insert-only.
+    # A click queued just before its code was deleted is dropped rather than left orphaned.
+    with transaction() as conn:
+        conn.executemany(
             """
-            UPDATE urls 
-            SET click_count = click_count + 1, last_accessed_at = CURRENT_TIMESTAMP
-            WHERE short_code = ?
+            INSERT INTO clicks (short_code, user_agent, ip_address, referrer, clicked_at)
+            SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM urls WHERE short_code = ?)
             """,
-            (short_code,),
+            [click + (click[0],) for click in clicks],
         )
-        conn.commit()
-    finally:
-        conn.close()
 
 
-def is_expired(expires_at: Optional[str]) -> bool:
-    """Check if a URL has expired."""
-    if not expires_at:
-        return False
-    from datetime import datetime
+def flush_clicks() -> int:
+    """Drain the click queue into the database in batches of CLICK_BATCH_SIZE.
+
+    If a write fails, its batch is kept and retried on the next flush before the error is raised.
 
-    exp_time = datetime.fromisoformat(expires_at)
-    return datetime.now() >= exp_time
+    Returns:
+        The number of clicks written.
+    """
+    written = 0
+    with click_flush_lock:
+        while True:
+            batch = unwritten_clicks[:CLICK_BATCH_SIZE]
+            del unwritten_clicks[: len(batch)]
+            try:
+                while len(batch) < CLICK_BATCH_SIZE:
+                    batch.append(click_queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return written
+            try:
+                record_clicks(batch)
+            except Exception:
+                unwritten_clicks[:0] = batch
+                raise
+            written += len(batch)
+
+
+async def click_flusher() -> None:
+    """Background task that periodically writes queued clicks to the database."""
+    while True:
+        await asyncio.sleep(CLICK_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_clicks)
+        except Exception as e:
+            logger.warning(f"Failed to flush clicks: {e}")
+
+
+def is_expired(expires_at_ts: Optional[int]) -> bool:
+    """Check if a URL has expired, given its expiration as unix epoch seconds."""
+    return expires_at_ts is not None and current_time() >= expires_at_ts
 
 
 def get_analytics(short_code: str) -> Optional[dict]:
     """Get analytics for a specific shortened URL."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    cursor = get_conn().cursor()
 
-    # Get URL info and click count
+    # Get URL info and click count (aggregated from the clicks table)
     cursor.execute(
         """
-        SELECT short_code, click_count, last_accessed_at, original_url
+        SELECT urls.short_code, COUNT(clicks.id), MAX(clicks.clicked_at)
         FROM urls
-        WHERE short_code = ?
+        LEFT JOIN clicks ON clicks.short_code = urls.short_code
+        WHERE urls.short_code = ?
+        GROUP BY urls.short_code
         """,
         (short_code,),
     )
     result = cursor.fetchone()
 
     if not result:
-        conn.close()
         return None
 
-    short_code, click_count, last_accessed_at, _ = result
+    short_code, click_count, last_click = result
 
-    conn.close()
-    return {"short_code": short_code, "click_count": click_count, "last_click": last_accessed_at}
+    return {"short_code": short_code, "click_count": click_count, "last_click": last_click}
 
 
 def get_all_analytics(page: int = 1, limit: int = 10) -> dict:
     """Get analytics for all shortened URLs with pagination."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
+    cursor = get_conn().cursor()
 
     # Get total count
     cursor.execute("SELECT COUNT(*) FROM urls")
     total_urls = cursor.fetchone()[0]
 
     # Get total clicks
-    cursor.execute("SELECT SUM(click_count) FROM urls")
-    total_clicks = cursor.fetchone()[0] or 0
+    cursor.execute("SELECT COUNT(*) FROM clicks")
+    total_clicks = cursor.fetchone()[0]
 
     # Get paginated results
     offset = (page - 1) * limit
     cursor.execute(
         """
-        SELECT short_code, original_url, click_count, created_at, last_accessed_at, expires_at, is_custom
+        SELECT urls.short_code, urls.original_url, COALESCE(totals.click_count, 0) AS click_count,
+               urls.created_at, totals.last_click, urls.expires_at, urls.is_custom
         FROM urls
-        ORDER BY click_count DESC, created_at DESC
+        LEFT JOIN (
+            SELECT short_code, COUNT(*) AS click_count, MAX(clicked_at) AS last_click
+            FROM clicks
+            GROUP BY short_code
+        ) AS totals ON totals.short_code = urls.short_code
+        ORDER BY click_count DESC, urls.created_at DESC
         LIMIT ? OFFSET ?
         """,
         (limit, offset),
     )
     rows = cursor.fetchall()
-    conn.close()
 
+    # Plain dicts are serialized directly by the response class, no per-row model objects
     urls = [
-        URLAnalytics(
-            short_code=row[0],
-            original_url=row[1],
-            short_url=f"{BASE_URL}/{row[0]}",
-            click_count=row[2],
-            created_at=row[3],
-            last_accessed_at=row[4],
-            expires_at=row[5],
-            is_custom=bool(row[6]),
-        )
+        {
+            "short_code": row[0],
+            "original_url": row[1],
+            "short_url": SHORT_URL_PREFIX + row[0],
+            "click_count": row[2],
+            "created_at": row[3],
+            "last_accessed_at": row[4],
+            "expires_at": row[5],
+            "is_custom": bool(row[6]),
+        }
         for row in rows
     ]
 
     total_pages = (total_urls + limit - 1) // limit
-    average_clicks = total_clicks / total_urls if total_urls > 0 else 0
+    average_clicks = total_clicks / total_urls if total_urls > 0 else 0.0
 
     return {
         "total_urls": total_urls,
@@ -377,44 +707,56 @@ def get_all_analytics(page: int = 1, limit: int = 10) -> dict:
 
 def save_url(short_code: str, original_url: str) -> None:
     """Save URL mapping to database"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
     try:
-        cursor.execute(
-            "INSERT INTO urls (short_code, original_url) VALUES (?, ?)",
-            (short_code, original_url),
-        )
-        conn.commit()
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO urls (short_code, original_url) VALUES (?, ?)",
+                (short_code, original_url),
+            )
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save URL mapping")
-    finally:
-        conn.close()
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qrcode(data: str) -> bytes:
+    """Render data as a QR code PNG (memoised, so each short URL is encoded once)"""
+    from io import BytesIO
+
+    import qrcode
+
+    # Generate QR code
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    # Convert to bytes
+    img_bytes = BytesIO()
+    img.save(img_bytes, format="PNG")
+    return img_bytes.getvalue()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan context manager"""
-    # Startup: Initialize database
+    # Startup: Initialize database and background maintenance
     init_db()
+    cleanup_task = asyncio.create_task(rate_limit_cleanup())
+    flusher_task = asyncio.create_task(click_flusher())
     yield
-    # Shutdown: Cleanup if needed
-
-
-# FastAPI Application
-app = FastAPI(title="URL Shortener API", description="API for shortening long URLs", version="1.0.0", lifespan=lifespan)
-
-# CORS Middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Configure for production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    # Shutdown: Stop background tasks and write any pending clicks
+    cleanup_task.cancel()
+    flusher_task.cancel()
+    await asyncio.to_thread(flush_clicks)
 
 
 # Rate Limiting Middleware
-@app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
     """Rate limiting middleware"""
     client_ip = request.client.host if request.client else "unknown"
@@ -425,20 +767,23 @@ async def rate_limit_middleware(request: Request, call_next):
 
     allowed, limit_info = check_rate_limit(client_ip)
     if not allowed:
-        logger.warning(f"Rate limit exceeded for IP {client_ip}")
-        return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded", "retry_after": limit_info["retry_after"]})
+        return rate_limited_response(client_ip, limit_info)
 
     return await call_next(request)
 
 
+# Routes are registered on a router so make_app() can mount them on any number of apps
+router = APIRouter()
+
+
 # Routes
-@app.get("/health", tags=["Health"])
+@router.get("/health", tags=["Health"])
 async def health() -> dict[str, str]:
     """Health check endpoint"""
     return {"status": "healthy"}
 
 
-@app.post(
+@router.post(
     "/shorten",
     response_model=URLResponse,
     status_code=status.HTTP_201_CREATED,
@@ -458,50 +803,48 @@ async def shorten_url(request: URLRequest) -> URLResponse:
     - **short_code**: The 6-character unique identifier or custom code
     - **short_url**: The full shortened URL
     """
-    original_url = str(request.url)
-
-    # Check if URL already exists (with same custom/expiration settings)
-    existing_code = get_existing_code(original_url)
-    if existing_code:
-        return URLResponse(short_code=existing_code, short_url=f"{BASE_URL}/{existing_code}")
-
-    # Determine short code
-    short_code = request.custom_code
-    is_custom = False
-
-    if short_code:
-        is_custom = True
-        # Check if custom code is available
-        if code_exists(short_code):
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Custom code '{short_code}' is already taken")
-    else:
-        # Generate new short code
-        short_code = generate_short_code()
-
-    # Save URL with custom flag and expiration
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            """
-            INSERT INTO urls (short_code, original_url, is_custom, expires_at)
-            VALUES (?, ?, ?, ?)
-            """,
-            (short_code, original_url, is_custom, request.expires_at),
-        )
-        conn.commit()
-    except sqlite3.IntegrityError:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save URL mapping")
-    finally:
-        conn.close()
+    short_code = await asyncio.to_thread(create_short_code, request.url, request.custom_code, request.expires_at)
 
     # Invalidate cache entry for this code (shouldn't exist but be safe)
     cache.invalidate(short_code)
 
-    return URLResponse(short_code=short_code, short_url=f"{BASE_URL}/{short_code}")
+    return URLResponse(short_code=short_code, short_url=SHORT_URL_PREFIX + short_code)
+
+
+@router.post(
+    "/shorten/batch",
+    response_model=list[URLResponse],
+    status_code=status.HTTP_201_CREATED,
+    tags=["URL Shortening"],
+    summary="Shorten several URLs",
+    description=f"Takes up to {BATCH_LIMIT} long URLs and returns their shortened versions in the same order",
+)
+async def shorten_urls_batch(request: BatchURLRequest, raw_request: Request):
+    """
+    Shorten several URLs in one request.
 
+    - **urls**: The long URLs to shorten (each must be a valid HTTP/HTTPS URL)
 
-@app.get(
+    Returns a list of **short_code** / **short_url** pairs, one per input URL.
+    URLs that were already shortened keep their existing code.
+    Each URL counts as one request towards the rate limit.
+    """
+    # The middleware already charged this request once; charge the remaining URLs
+    client_ip = raw_request.client.host if raw_request.client else "unknown"
+    allowed, limit_info = check_rate_limit(client_ip, cost=len(request.urls) - 1)
+    if not allowed:
+        return rate_limited_response(client_ip, limit_info)
+
+    short_codes = await asyncio.to_thread(create_short_codes, request.urls)
+
+    # Drop any cached "not found" entries for the new codes
+    for short_code in short_codes:
+        cache.invalidate(short_code)
+
+    return [{"short_code": short_code, "short_url": SHORT_URL_PREFIX + short_code} for short_code in short_codes]
+
+
+@router.get(
     "/{short_code}",
     tags=["URL Redirection"],
     summary="Redirect to original URL",
@@ -515,19 +858,15 @@ async def redirect_url(short_code: str, request: Request) -> RedirectResponse:
 
     Returns a 307 redirect to the original URL.
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT original_url, expires_at FROM urls WHERE short_code = ?", (short_code,))
-    result = cursor.fetchone()
-    conn.close()
+    record = await get_url_record(short_code)
 
-    if not result:
+    if not record:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Short code '{short_code}' not found")
 
-    original_url, expires_at = result
+    original_url, expires_at_ts = record
 
     # Check if expires
-    if is_expired(expires_at):
+    if is_expired(expires_at_ts):
         raise HTTPException(status_code=410, detail="This short link has expired")
 
     # Record click
@@ -544,7 +883,7 @@ async def redirect_url(short_code: str, request: Request) -> RedirectResponse:
     return RedirectResponse(url=original_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
 
 
-@app.get(
+@router.get(
     "/info/{short_code}",
     response_model=URLInfo,
     tags=["URL Information"],
@@ -559,15 +898,15 @@ async def get_url_info(short_code: str) -> URLInfo:
 
     Returns the original URL and short URL information.
     """
-    original_url = get_original_url(short_code)
+    original_url = await get_original_url(short_code)
 
     if not original_url:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Short code '{short_code}' not found")
 
-    return URLInfo(short_code=short_code, original_url=original_url, short_url=f"{BASE_URL}/{short_code}")
+    return URLInfo(short_code=short_code, original_url=original_url, short_url=SHORT_URL_PREFIX + short_code)
 
 
-@app.get(
+@router.get(
     "/api/cache-stats",
     tags=["Cache"],
     summary="Get cache statistics",
@@ -578,7 +917,7 @@ async def cache_stats() -> dict:
     return cache.stats()
 
 
-@app.post(
+@router.post(
     "/api/cache-clear",
     tags=["Cache"],
     summary="Clear cache",
@@ -587,27 +926,29 @@ async def cache_stats() -> dict:
 async def cache_clear() -> dict:
     """Clear all cache entries and reset statistics."""
     cache.clear()
-    return {"message": "Cache cleared", "timestamp": __import__("datetime").datetime.now().isoformat()}
+    return {"message": "Cache cleared", "timestamp": datetime.now().isoformat()}
 
 
-@app.get(
+@router.get(
     "/api/analytics",
     response_model=AnalyticsListResponse,
     tags=["Analytics"],
     summary="Get all analytics",
     description="Retrieve analytics for all shortened URLs with pagination",
 )
-async def get_all_analytics_endpoint(page: int = 1, limit: int = 10) -> AnalyticsListResponse:
+async def get_all_analytics_endpoint(page: int = 1, limit: int = 10) -> ORJSONResponse:
     """Get analytics for all shortened URLs.
 
     - **page**: Page number (default: 1)
     - **limit**: Results per page (default: 10)
     """
-    result = get_all_analytics(page, limit)
-    return AnalyticsListResponse(**result)
+    await asyncio.to_thread(flush_clicks)
+    result = await asyncio.to_thread(get_all_analytics, page, limit)
+    # Returned as a Response so FastAPI skips re-validating every row; response_model only documents the schema
+    return ORJSONResponse(result)
 
 
-@app.get(
+@router.get(
     "/api/analytics/{short_code}",
     response_model=AnalyticsResponse,
     tags=["Analytics"],
@@ -619,13 +960,14 @@ async def get_analytics_endpoint(short_code: str) -> AnalyticsResponse:
 
     - **short_code**: The 6-character short code
     """
-    analytics = get_analytics(short_code)
+    await asyncio.to_thread(flush_clicks)
+    analytics = await asyncio.to_thread(get_analytics, short_code)
     if not analytics:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Short code '{short_code}' not found")
     return AnalyticsResponse(**analytics)
 
 
-@app.get(
+@router.get(
     "/api/qrcode/{short_code}",
     tags=["QR Code"],
     summary="Get QR code for URL",
@@ -637,41 +979,18 @@ async def get_qrcode(short_code: str):
     Returns the QR code as an SVG image.
     - **short_code**: The 6-character short code
     """
-    if not code_exists(short_code):
+    if not await get_url_record(short_code):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Short code '{short_code}' not found")
 
     try:
-        from io import BytesIO
-
-        import qrcode
-        from fastapi.responses import StreamingResponse
-
-        short_url = f"{BASE_URL}/{short_code}"
-
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(short_url)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-
-        # Convert to bytes
-        img_bytes = BytesIO()
-        img.save(img_bytes, format="PNG")
-        img_bytes.seek(0)
-
-        return StreamingResponse(img_bytes, media_type="image/png")
+        png = await asyncio.to_thread(render_qrcode, SHORT_URL_PREFIX + short_code)
+        return Response(content=png, media_type="image/png")
     except Exception as e:
         logging.error(f"Failed to generate QR code: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to generate QR code")
 
 
-@app.get(
+@router.get(
     "/api/rate-limit-stats",
     tags=["Rate Limiting"],
     summary="Get rate limit statistics",
@@ -682,12 +1001,12 @@ async def get_rate_limit_stats() -> dict:
     return {
         "rate_limit_requests": RATE_LIMIT_REQUESTS,
         "rate_limit_window_seconds": RATE_LIMIT_WINDOW,
-        "active_ips": len(rate_limit_tracker),
-        "timestamp": __import__("datetime").datetime.now().isoformat(),
+        "active_ips": sum(len(shard) for shard in rate_limit_tracker),
+        "timestamp": datetime.now().isoformat(),
     }
 
 
-@app.delete(
+@router.delete(
     "/{short_code}",
     tags=["URL Management"],
     summary="Delete a shortened URL",
@@ -698,33 +1017,54 @@ async def delete_url(short_code: str) -> dict:
 
     - **short_code**: The 6-character short code
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    # Check if URL exists
-    cursor.execute("SELECT id FROM urls WHERE short_code = ?", (short_code,))
-    url_record = cursor.fetchone()
+    try:
+        deleted = await asyncio.to_thread(delete_url_record, short_code)
+    except Exception as e:
+        logger.error(f"Failed to delete URL: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to delete URL")
 
-    if not url_record:
+    if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Short code '{short_code}' not found")
 
-    try:
-        # Delete clicks
-        cursor.execute("DELETE FROM clicks WHERE short_code = ?", (short_code,))
-        # Delete URL
-        cursor.execute("DELETE FROM urls WHERE short_code = ?", (short_code,))
-        conn.commit()
+    # Invalidate cache
+    cache.invalidate(short_code)
 
-        # Invalidate cache
-        cache.invalidate(short_code)
+    logger.info(f"Deleted URL with short code: {short_code}")
+    return {"message": f"Successfully deleted short code '{short_code}'"}
 
-        logger.info(f"Deleted URL with short code: {short_code}")
-        return {"message": f"Successfully deleted short code '{short_code}'"}
-    except Exception as e:
-        logger.error(f"Failed to delete URL: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to delete URL")
-    finally:
-        conn.close()
+
+# FastAPI Application
+def make_app(config: Optional[dict] = None) -> FastAPI:
+    """Build the application; config entries override the FastAPI constructor defaults.
+
+    Every app shares this module's database, caches and rate limiter. Each one also runs its own
+    lifespan when served, so an extra app starts a second rate limit cleanup and click flusher
+    against the same globals (safe, since both only take the shared locks, but redundant).
+    """
+    settings = {
+        "title": "URL Shortener API",
+        "description": "API for shortening long URLs",
+        "version": "1.0.0",
+        "lifespan": lifespan,
+        "default_response_class": ORJSONResponse,
+    }
+    settings.update(config or {})
+    application = FastAPI(**settings)
+
+    # CORS Middleware
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Configure for production
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    application.middleware("http")(rate_limit_middleware)
+    application.include_router(router)
+    return application
+
+
+app = make_app()
 
 
 if __name__ == "__main__":
@@ -1,91 +1,173 @@
 """
 Basic integration tests for URL Shortener API.
 
-To run these tests:
-  pip install pytest
-  pytest tests/test_api.py -v
+To run these tests (from the backend directory):
+  pip install -r requirements.txt
+  pytest -v
 """
 
-import os
+import asyncio
+import json
 import sqlite3
-import sys
-import tempfile
-from pathlib import Path
 
 import pytest
-
-# Add backend to path
-sys.path.insert(0, str(Path(__file__).parent))
-
-# Set test database path
-test_db_dir = tempfile.mkdtemp()
-os.environ["DATABASE_PATH"] = test_db_dir
-
-from fastapi.testclient import TestClient
-from main import app, cache, init_db
-
-client = TestClient(app)
-
-
-@pytest.fixture(scope="session", autouse=True)
-def setup_test_db():
-    """Initialize test database before running tests."""
-    init_db()
-    yield
-    # Cleanup is optional - temp directory will be removed by system
-
-
-@pytest.fixture(autouse=True)
-def clear_cache():
-    """Clear cache before each test."""
-    cache.clear()
-    yield
+from conftest import make_url
+
+
+def dumps(obj) -> bytes:
+    """Encode a request payload (once, at import) as JSON bytes."""
+    return json.dumps(obj).encode()
+
+
+# Request payloads, encoded once at import and posted as raw bytes
+SHORTEN_PAYLOADS = {
+    "valid": {"url": make_url("test")},
+    "invalid_url": {"url": "not-a-url"},
+    "non_http": {"url": "ftp://example.com/file"},
+    "trailing_newline": {"url": make_url("newline") + "\n"},
+    "empty_host": {"url": "http://@"},
+    "colons_only": {"url": "http://:::"},
+    "unclosed_ipv6": {"url": "http://[::1"},
+    "port_out_of_range": {"url": "https://example.com:99999/"},
+    "nul_in_host": {"url": "http://a\x00b.com/x"},
+    "cache": {"url": make_url("cache-test")},
+    "analytics": {"url": make_url("analytics-test")},
+    "custom_valid": {"url": make_url("custom-test"), "custom_code": "mycode"},
+    "custom_first": {"url": make_url("first"), "custom_code": "taken"},
+    "custom_second": {"url": make_url("second"), "custom_code": "taken"},
+    "custom_too_short": {"url": make_url("invalid"), "custom_code": "12"},
+    "custom_reserved": {"url": make_url("reserved"), "custom_code": "api"},
+    "expired": {"url": make_url("expired"), "expires_at": "2000-01-01T00:00:00"},
+    "not_expired": {"url": make_url("not-expired"), "expires_at": "2999-01-01T00:00:00"},
+    "bad_expiry": {"url": make_url("bad-expiry"), "expires_at": "tomorrow"},
+}
+SHORTEN_BODIES = {name: dumps(payload) for name, payload in SHORTEN_PAYLOADS.items()}
+
+# Payloads POST /shorten must reject, with the expected status
+BAD_SHORTEN_CASES = {
+    "invalid_url": 422,
+    "non_http": 422,
+    "trailing_newline": 422,
+    "empty_host": 422,
+    "colons_only": 422,
+    "unclosed_ipv6": 422,
+    "port_out_of_range": 422,
+    "nul_in_host": 422,
+    "custom_too_short": 422,
+    "custom_reserved": 422,
+}
+
+BATCH_URLS = [make_url("batch"), make_url("batch")]
+BATCH_URLS.append(BATCH_URLS[0])
+BATCH_BODY = dumps({"urls": BATCH_URLS})
+BATCH_INVALID_BODY = dumps({"urls": [make_url("ok"), "not-a-url"]})
+
+JSON_HEADERS = {"content-type": "application/json"}
+
+# urls table as created before expires_at_ts existed (and before expires_at was validated)
+LEGACY_URLS_TABLE = """
+    CREATE TABLE urls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        short_code TEXT UNIQUE NOT NULL,
+        original_url TEXT NOT NULL,
+        click_count INTEGER DEFAULT 0,
+        is_custom BOOLEAN DEFAULT 0,
+        expires_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_accessed_at TIMESTAMP
+    )
+"""
 
 
 class TestBasicEndpoints:
     """Test basic API endpoints."""
 
-    def test_health_check(self):
-        """Test health check endpoint."""
+    def test_health_check(self, client):
+        """Test health check endpoint (end-to-end through routing and middleware)."""
         response = client.get("/health")
         assert response.status_code == 200
         assert response.json()["status"] == "healthy"
 
-    def test_shorten_valid_url(self):
+    def test_shorten_valid_url(self, client):
         """Test shortening a valid URL."""
-        response = client.post("/shorten", json={"url": "https://example.com/test"})
+        response = client.post("/shorten", content=SHORTEN_BODIES["valid"], headers=JSON_HEADERS)
         assert response.status_code == 201
         data = response.json()
         assert "short_code" in data
         assert "short_url" in data
         assert len(data["short_code"]) == 6
 
-    def test_shorten_invalid_url(self):
-        """Test that invalid URLs are rejected."""
-        response = client.post("/shorten", json={"url": "not-a-url"})
+    @pytest.mark.asyncio
+    async def test_shorten_rejects_bad_input(self, async_client):
+        """Test that invalid URLs and custom codes are rejected, posting every case at once."""
+        responses = await asyncio.gather(
+            *[async_client.post("/shorten", content=SHORTEN_BODIES[name], headers=JSON_HEADERS) for name in BAD_SHORTEN_CASES]
+        )
+        for name, response in zip(BAD_SHORTEN_CASES, responses):
+            assert response.status_code == BAD_SHORTEN_CASES[name], name
+
+    def test_shorten_batch(self, client):
+        """Test shortening several URLs in one request."""
+        response = client.post("/shorten/batch", content=BATCH_BODY, headers=JSON_HEADERS)
+        assert response.status_code == 201
+        data = response.json()
+        assert len(data) == 3
+        assert data[0]["short_code"] != data[1]["short_code"]
+        # Duplicate URLs share a code
+        assert data[0]["short_code"] == data[2]["short_code"]
+
+        response = client.get(f"/{data[1]['short_code']}", follow_redirects=False)
+        assert response.headers["location"] == BATCH_URLS[1]
+
+    def test_shorten_batch_invalid_url(self, client):
+        """Test that a batch with an invalid URL is rejected."""
+        response = client.post("/shorten/batch", content=BATCH_INVALID_BODY, headers=JSON_HEADERS)
         assert response.status_code == 422
 
-    def test_redirect_to_shortened_url(self):
+    def test_shorten_batch_rolls_back_on_failure(self, main_module, db_conn, monkeypatch):
+        """Test that a batch which can't place every URL stores none of them."""
+        urls = [make_url("rollback"), make_url("rollback")]
+        # Every generated code is the same, so the second URL can never be placed
+        monkeypatch.setattr(main_module, "generate_short_code", lambda: "samecode")
+        with pytest.raises(Exception) as excinfo:
+            main_module.create_short_codes(urls)
+        assert excinfo.value.status_code == 500
+        assert db_conn.execute("SELECT COUNT(*) FROM urls WHERE original_url IN (?, ?)", urls).fetchone()[0] == 0
+
+    @pytest.mark.asyncio
+    async def test_shorten_batch_charges_rate_limit_per_url(self, main_module, monkeypatch):
+        """Test that each URL in a batch counts towards the rate limit."""
+        import httpx
+
+        monkeypatch.setattr(main_module, "RATE_LIMIT_REQUESTS", 3)
+        # A client address no other test uses, so its rate limit window starts empty
+        transport = httpx.ASGITransport(app=main_module.app, client=("203.0.113.7", 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            body = dumps({"urls": [make_url("charged"), make_url("charged"), make_url("charged")]})
+            response = await ac.post("/shorten/batch", content=body, headers=JSON_HEADERS)
+            assert response.status_code == 201
+
+            # The three URLs used up the whole allowance
+            response = await ac.get("/api/cache-stats")
+            assert response.status_code == 429
+
+    def test_redirect_to_shortened_url(self, client, created_codes):
         """Test redirecting to original URL."""
-        # Create shortened URL
-        create_response = client.post("/shorten", json={"url": "https://example.com/redirect-test"})
-        code = create_response.json()["short_code"]
+        code = created_codes["redirect"]
 
         # Redirect
         response = client.get(f"/{code}", follow_redirects=False)
         assert response.status_code == 307
         assert "example.com/redirect-test" in response.headers["location"]
 
-    def test_redirect_nonexistent(self):
+    def test_redirect_nonexistent(self, client):
         """Test that redirecting to nonexistent code returns 404."""
         response = client.get("/nonexistent404")
         assert response.status_code == 404
 
-    def test_get_url_info(self):
+    def test_get_url_info(self, client, created_codes):
         """Test GET /info/{code} endpoint."""
-        # Create shortened URL
-        create_response = client.post("/shorten", json={"url": "https://example.com/info-test"})
-        code = create_response.json()["short_code"]
+        code = created_codes["info"]
 
         # Get info
         response = client.get(f"/info/{code}")
@@ -98,34 +180,62 @@ class TestBasicEndpoints:
 class TestCaching:
     """Test LRU caching functionality."""
 
-    def test_cache_stats(self):
-        """Test cache statistics endpoint."""
-        response = client.get("/api/cache-stats")
-        assert response.status_code == 200
-        stats = response.json()
+    def test_stats_endpoints(self, main_module):
+        """Test cache and rate limit statistics endpoints in one pass."""
+
+        async def fetch_stats():
+            return await asyncio.gather(main_module.cache_stats(), main_module.get_rate_limit_stats())
+
+        stats, rate_limits = asyncio.run(fetch_stats())
         assert "hits" in stats
         assert "misses" in stats
         assert "hit_rate" in stats
+        assert "rate_limit_requests" in rate_limits
+        assert "rate_limit_window_seconds" in rate_limits
 
-    def test_cache_hit_improves_performance(self):
+    @pytest.mark.asyncio
+    async def test_cache_hit_improves_performance(self, async_client, main_module):
         """Test that multiple accesses to the same URL work correctly."""
         # Create a URL
-        response = client.post("/shorten", json={"url": "https://example.com/cache-test"})
+        response = await async_client.post("/shorten", content=SHORTEN_BODIES["cache"], headers=JSON_HEADERS)
         assert response.status_code == 201
         code = response.json()["short_code"]
 
-        # First access
-        response1 = client.get(f"/{code}", follow_redirects=False)
-        assert response1.status_code == 307
-
-        # Second access (cached)
-        response2 = client.get(f"/{code}", follow_redirects=False)
-        assert response2.status_code == 307
-
-        # Both should redirect to the same location
-        assert response1.headers["location"] == response2.headers["location"]
-
-    def test_cache_clear(self):
+        # Access it several times concurrently; these may all miss before the first lookup is cached
+        responses = await asyncio.gather(*[async_client.get(f"/{code}", follow_redirects=False) for _ in range(5)])
+        for response in responses:
+            assert response.status_code == 307
+
+        # All should redirect to the same location
+        assert len({response.headers["location"] for response in responses}) == 1
+
+        # Once cached, every further access is a hit
+        hits = main_module.cache.stats()["hits"]
+        for _ in range(3):
+            response = await async_client.get(f"/{code}", follow_redirects=False)
+            assert response.headers["location"] == responses[0].headers["location"]
+        assert main_module.cache.stats()["hits"] == hits + 3
+
+    @pytest.mark.parametrize("max_size", [1, 10, 16, 1000])
+    def test_cache_size_matches_config(self, max_size):
+        """Test that the shards add up to exactly the configured cache size."""
+        from cache import URLCache
+
+        url_cache = URLCache(max_size=max_size)
+        assert url_cache.max_size == max_size
+        assert sum(shard.maxsize for shard in url_cache.shards) == max_size
+        assert all(shard.maxsize >= 1 for shard in url_cache.shards)
+
+    def test_stale_lookup_not_cached(self, main_module):
+        """Test that a lookup which raced with an invalidation doesn't cache its result."""
+        code = "stale-lookup"
+        generation = main_module.cache.generation(code)
+        # A delete commits and invalidates the code while the lookup is still running
+        main_module.cache.invalidate(code)
+        assert not main_module.cache.set(code, ("https://example.com/deleted", None), generation)
+        assert main_module.cache.get(code) is None
+
+    def test_cache_clear(self, client):
         """Test cache clearing."""
         response = client.post("/api/cache-clear")
         assert response.status_code == 200
@@ -133,83 +243,166 @@ class TestCaching:
 
 
 class TestAnalytics:
-    """Test analytics functionality."""
+    """Test analytics functionality.
+
+    The tests share one short code and run in definition order, so the click test stays last.
+    """
 
-    def test_analytics_endpoint(self):
+    @pytest.fixture(scope="class")
+    def created_code(self, client):
+        """Short code created once for the whole class."""
+        response = client.post("/shorten", content=SHORTEN_BODIES["analytics"], headers=JSON_HEADERS)
+        assert response.status_code == 201
+        return response.json()["short_code"]
+
+    def test_analytics_endpoint(self, client, main_module, db_conn):
         """Test GET /api/analytics endpoint."""
-        response = client.get("/api/analytics?page=1&limit=10")
+        # One-row page keeps the response contract covered
+        response = client.get("/api/analytics?limit=1")
         assert response.status_code == 200
         data = response.json()
-        assert "total_urls" in data
-        assert "total_clicks" in data
-        assert "urls" in data
-
-    def test_analytics_for_specific_code(self):
+        assert {"total_urls", "total_clicks", "urls", "page", "total_pages"} <= data.keys()
+        assert len(data["urls"]) <= 1
+
+        # Totals match the tables the endpoint aggregates
+        main_module.flush_clicks()
+        assert db_conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0] == data["total_urls"]
+        assert db_conn.execute("SELECT COUNT(*) FROM clicks").fetchone()[0] == data["total_clicks"]
+
+    def test_analytics_empty_database(self, main_module, file_db):
+        """Test that analytics for an empty database report a float average."""
+        main_module.init_db()
+        data = main_module.get_all_analytics()
+        assert data["total_urls"] == 0
+        assert data["average_clicks"] == 0.0
+        assert isinstance(data["average_clicks"], float)
+
+    def test_analytics_for_specific_code(self, client, created_code):
         """Test GET /api/analytics/{code} endpoint."""
-        # Create URL
-        response = client.post("/shorten", json={"url": "https://example.com/analytics-test"})
-        code = response.json()["short_code"]
-
-        # Get analytics
+        code = created_code
         response = client.get(f"/api/analytics/{code}")
         assert response.status_code == 200
         data = response.json()
         assert data["short_code"] == code
         assert data["click_count"] == 0
 
-    def test_click_tracking(self):
+    def test_click_for_deleted_code_dropped(self, main_module, db_conn):
+        """Test that a click queued for a code that no longer exists isn't written."""
+        main_module.record_click("deleted-code", "agent", "127.0.0.1", None)
+        main_module.flush_clicks()
+        assert db_conn.execute("SELECT COUNT(*) FROM clicks WHERE short_code = ?", ("deleted-code",)).fetchone()[0] == 0
+
+    def test_failed_click_write_retried(self, main_module, db_conn, monkeypatch):
+        """Test that clicks from a failed batch write are kept and written by the next flush."""
+        code = main_module.create_short_code(make_url("click-retry"))
+        record_clicks = main_module.record_clicks
+
+        def failing_record_clicks(clicks):
+            raise sqlite3.OperationalError("database is locked")
+
+        monkeypatch.setattr(main_module, "record_clicks", failing_record_clicks)
+        main_module.record_click(code, "agent", "127.0.0.1", None)
+        with pytest.raises(sqlite3.OperationalError):
+            main_module.flush_clicks()
+
+        monkeypatch.setattr(main_module, "record_clicks", record_clicks)
+        main_module.flush_clicks()
+        assert db_conn.execute("SELECT COUNT(*) FROM clicks WHERE short_code = ?", (code,)).fetchone()[0] == 1
+
+    @pytest.mark.asyncio
+    async def test_click_tracking(self, async_client, created_code, main_module, db_conn):
         """Test that clicks are tracked."""
-        # Create URL
-        response = client.post("/shorten", json={"url": "https://example.com/click-test"})
-        code = response.json()["short_code"]
+        code = created_code
 
-        # Access the URL (should record a click)
-        client.get(f"/{code}", follow_redirects=False)
+        # Access the URL concurrently (each should record a click)
+        responses = await asyncio.gather(*[async_client.get(f"/{code}", follow_redirects=False) for _ in range(5)])
+        for response in responses:
+            assert response.status_code == 307
 
-        # Check analytics
-        response = client.get(f"/api/analytics/{code}")
-        assert response.status_code == 200
-        assert response.json()["click_count"] >= 1
+        # Write the queued clicks and count them in the clicks table (the source of click_count)
+        main_module.flush_clicks()
+        assert db_conn.execute("SELECT COUNT(*) FROM clicks WHERE short_code = ?", (code,)).fetchone()[0] == 5
 
 
 class TestCustomCodes:
     """Test custom code functionality."""
 
-    def test_custom_code_valid(self):
+    def test_custom_code_valid(self, client):
         """Test shortening with a valid custom code."""
-        response = client.post("/shorten", json={"url": "https://example.com/custom-test", "custom_code": "mycode"})
+        response = client.post("/shorten", content=SHORTEN_BODIES["custom_valid"], headers=JSON_HEADERS)
         assert response.status_code == 201
         data = response.json()
         assert data["short_code"] == "mycode"
 
-    def test_custom_code_duplicate(self):
+    def test_custom_code_duplicate(self, client):
         """Test that duplicate custom codes are rejected."""
         # First URL
-        client.post("/shorten", json={"url": "https://example.com/first", "custom_code": "taken"})
+        client.post("/shorten", content=SHORTEN_BODIES["custom_first"], headers=JSON_HEADERS)
 
         # Second URL with same custom code
-        response = client.post("/shorten", json={"url": "https://example.com/second", "custom_code": "taken"})
+        response = client.post("/shorten", content=SHORTEN_BODIES["custom_second"], headers=JSON_HEADERS)
         assert response.status_code == 409
 
-    def test_custom_code_invalid_format(self):
-        """Test that invalid custom codes are rejected."""
-        response = client.post("/shorten", json={"url": "https://example.com/invalid", "custom_code": "12"})  # Too short
-        assert response.status_code == 422
 
-    def test_custom_code_reserved(self):
-        """Test that reserved words are rejected."""
-        response = client.post("/shorten", json={"url": "https://example.com/reserved", "custom_code": "api"})
+class TestExpiration:
+    """Test URL expiration."""
+
+    def test_expired_url_returns_gone(self, client):
+        """Test that an expired URL no longer redirects."""
+        response = client.post("/shorten", content=SHORTEN_BODIES["expired"], headers=JSON_HEADERS)
+        code = response.json()["short_code"]
+
+        response = client.get(f"/{code}", follow_redirects=False)
+        assert response.status_code == 410
+
+    def test_future_expiration_redirects(self, client):
+        """Test that a URL with a future expiration still redirects."""
+        response = client.post("/shorten", content=SHORTEN_BODIES["not_expired"], headers=JSON_HEADERS)
+        code = response.json()["short_code"]
+
+        response = client.get(f"/{code}", follow_redirects=False)
+        assert response.status_code == 307
+
+    def test_invalid_expiration_rejected(self, client):
+        """Test that a malformed expiration is rejected."""
+        response = client.post("/shorten", content=SHORTEN_BODIES["bad_expiry"], headers=JSON_HEADERS)
         assert response.status_code == 422
 
+    def test_fractional_expiration_rounds_up(self, main_module):
+        """Test that an expiration with fractional seconds isn't truncated to an earlier second."""
+        assert main_module.expiry_timestamp("2999-01-01T00:00:00.5") == main_module.expiry_timestamp("2999-01-01T00:00:01")
+
+    def test_legacy_expiry_backfill(self, main_module, file_db):
+        """Test that init_db migrates a legacy database, including unparseable expirations."""
+        legacy = sqlite3.connect(file_db)
+        legacy.execute(LEGACY_URLS_TABLE)
+        legacy.executemany(
+            "INSERT INTO urls (short_code, original_url, expires_at) VALUES (?, ?, ?)",
+            [
+                ("expired", "https://example.com/a", "2000-01-01T00:00:00"),
+                ("future", "https://example.com/b", "2999-01-01T00:00:00"),
+                ("garbage", "https://example.com/c", "tomorrow"),
+                ("forever", "https://example.com/d", None),
+            ],
+        )
+        legacy.commit()
+        legacy.close()
+
+        main_module.init_db()
+        expiries = dict(main_module.get_conn().execute("SELECT short_code, expires_at_ts FROM urls"))
+
+        assert main_module.is_expired(expiries["expired"])
+        assert not main_module.is_expired(expiries["future"])
+        assert main_module.is_expired(expiries["garbage"])
+        assert expiries["forever"] is None
+
 
 class TestDeletion:
     """Test URL deletion functionality."""
 
-    def test_delete_url(self):
+    def test_delete_url(self, client, created_codes):
         """Test DELETE /{code} endpoint."""
-        # Create URL
-        response = client.post("/shorten", json={"url": "https://example.com/delete-test"})
-        code = response.json()["short_code"]
+        code = created_codes["delete"]
 
         # Delete
         response = client.delete(f"/{code}")
@@ -224,33 +417,96 @@ class TestDeletion:
 class TestQRCode:
     """Test QR code generation."""
 
-    def test_qrcode_generation(self):
+    def test_qrcode_generation(self, client, created_codes):
         """Test QR code generation endpoint."""
-        # Create URL
-        response = client.post("/shorten", json={"url": "https://example.com/qr-test"})
-        code = response.json()["short_code"]
+        code = created_codes["qrcode"]
 
         # Get QR code
         response = client.get(f"/api/qrcode/{code}")
         assert response.status_code == 200
         assert response.headers["content-type"] == "image/png"
+        assert response.content[:4] == b"\x89PNG"
+
+        # Repeat request is served from the PNG cache
+        cached_response = client.get(f"/api/qrcode/{code}")
+        assert cached_response.status_code == 200
+        assert cached_response.content == response.content
 
-    def test_qrcode_nonexistent(self):
+    def test_qrcode_nonexistent(self, client):
         """Test QR code for nonexistent code."""
         response = client.get("/api/qrcode/nonexistent")
         assert response.status_code == 404
 
 
-class TestRateLimiting:
-    """Test rate limiting functionality."""
 
-    def test_rate_limit_stats(self):
-        """Test rate limit statistics endpoint."""
-        response = client.get("/api/rate-limit-stats")
-        assert response.status_code == 200
-        data = response.json()
-        assert "rate_limit_requests" in data
-        assert "rate_limit_window_seconds" in data
+class TestRateLimiting:
+    """Test the rate limiter directly, with a small limit and a fake clock."""
+
+    LIMIT = 3
+    WINDOW = 10
+
+    @pytest.fixture
+    def clock(self, main_module, monkeypatch):
+        """Install an empty tracker and a settable clock; returns a one-item list holding the time."""
+        from cachetools import TTLCache
+
+        now = [1000.0]
+        monkeypatch.setattr(main_module, "RATE_LIMIT_REQUESTS", self.LIMIT)
+        monkeypatch.setattr(main_module, "RATE_LIMIT_WINDOW", self.WINDOW)
+        monkeypatch.setattr(main_module, "current_time", lambda: now[0])
+        tracker = [TTLCache(maxsize=16, ttl=self.WINDOW * 2, timer=lambda: now[0]) for _ in range(main_module.RATE_LIMIT_SHARDS)]
+        monkeypatch.setattr(main_module, "rate_limit_tracker", tracker)
+        return now
+
+    def test_rejects_at_limit(self, main_module, clock):
+        """Test that requests over the limit are rejected with a retry_after."""
+        for _ in range(self.LIMIT):
+            clock[0] += 1
+            assert main_module.check_rate_limit("10.0.0.1") == (True, None)
+
+        # Oldest request was at 1001; it leaves the window at 1011
+        allowed, info = main_module.check_rate_limit("10.0.0.1")
+        assert not allowed
+        assert info == {"retry_after": int(self.WINDOW - (clock[0] - 1001)) + 1, "limit": self.LIMIT, "window": self.WINDOW}
+
+        # Other IPs have their own allowance
+        assert main_module.check_rate_limit("10.0.0.2") == (True, None)
+
+    def test_window_slides(self, main_module, clock):
+        """Test that requests become allowed again as old ones leave the window."""
+        for _ in range(self.LIMIT):
+            clock[0] += 1
+            main_module.check_rate_limit("10.0.0.1")
+        assert not main_module.check_rate_limit("10.0.0.1")[0]
+
+        # Only the first request (at 1001) has left the window, so one more is allowed
+        clock[0] = 1001 + self.WINDOW
+        assert main_module.check_rate_limit("10.0.0.1") == (True, None)
+        assert not main_module.check_rate_limit("10.0.0.1")[0]
+
+    def test_cost_charges_several_requests(self, main_module, clock):
+        """Test that a cost above one uses up that many requests at once."""
+        assert main_module.check_rate_limit("10.0.0.1", cost=self.LIMIT) == (True, None)
+        assert not main_module.check_rate_limit("10.0.0.1")[0]
+
+    def test_expire_evicts_idle_ips(self, main_module, clock):
+        """Test that expire_rate_limits() drops IPs idle for longer than the TTL."""
+        from cachetools import Cache
+
+        main_module.check_rate_limit("10.0.0.1")
+        clock[0] += self.WINDOW
+        main_module.check_rate_limit("10.0.0.2")
+
+        clock[0] += self.WINDOW + 1
+
+        # Cache.__len__ counts stored entries, including ones past their TTL that still hold memory
+        def stored():
+            return sum(Cache.__len__(shard) for shard in main_module.rate_limit_tracker)
+
+        assert stored() == 2
+        main_module.expire_rate_limits()
+        assert stored() == 1
+        assert {ip for shard in main_module.rate_limit_tracker for ip in shard} == {"10.0.0.2"}
 
 
 if __name__ == "__main__":